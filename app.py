@@ -19,17 +19,27 @@ except ImportError:
         def get_contents(self, path, ref): return type('Contents', (object,), {'sha': 'dummy_sha'})
         def update_file(self, path, msg, content, sha, branch): pass
         def create_file(self, path, msg, content, sha, branch): pass
+        def delete_file(self, path, msg, sha, branch): pass
 
 # --- Nomes dos arquivos CSV e Configuração ---
 CLIENTES_CSV = 'clientes.csv'
-LANÇAMENTOS_CSV = 'lancamentos.csv'
+LANÇAMENTOS_CSV = 'lancamentos.csv' # Formato antigo (arquivo único), lido apenas para migração
+LANÇAMENTOS_DIR = 'lancamentos' # Partições mensais: lancamentos/AAAA-MM.csv
+RESUMO_LANÇAMENTOS_CSV = 'lancamentos_resumo.csv' # Créditos/débitos/vendas por mês e cliente
+MESES_RECENTES_LANÇAMENTOS = 3 # Meses carregados por padrão ao abrir a sessão
 PRODUTOS_TURBO_CSV = 'produtos_turbo.csv'
 BONUS_INDICACAO_PERCENTUAL = 0.03 # 3% para o indicador
 CASHBACK_INDICADO_PRIMEIRA_COMPRA = 0.05 # 3% para o indicado
+DIAS_EXPIRACAO_CASHBACK = 180 # Créditos expiram 180 dias após a Data do lançamento
 
 # Configuração do logo para o novo layout
 LOGO_DOCEBELLA_URL = "https://i.ibb.co/fYCWBKTm/Logo-Doce-Bella-Cosm-tico.png" # Link do logo
 
+CLIENTES_COLS = ['Nome', 'Apelido/Descrição', 'Telefone', 'Cashback Disponível', 'Gasto Acumulado', 'Nivel Atual', 'Indicado Por', 'Primeira Compra Feita']
+LANÇAMENTOS_COLS = ['Data', 'Cliente', 'Tipo', 'Valor Venda/Resgate', 'Valor Cashback', 'Venda Turbo']
+RESUMO_COLS = ['Mês', 'Cliente', 'Créditos', 'Débitos', 'Vendas']
+PRODUTOS_TURBO_COLS = ['Nome Produto', 'Data Início', 'Data Fim', 'Ativo']
+
 # --- Definição dos Níveis ---
 NIVEIS = {
     'Prata': {
@@ -118,58 +128,254 @@ def salvar_dados_no_github(df: pd.DataFrame, file_path: str, commit_message: str
         print(f"--- ERRO DETALHADO GITHUB [{file_path}] ---\n{repr(e)}\n-----------------------------------------")
         return False
 
+def carregar_dados_do_csv(file_path, df_columns):
+    df = pd.DataFrame(columns=df_columns)
+    if PERSISTENCE_MODE == "GITHUB":
+        url_raw = f"{URL_BASE_REPOS}{file_path}"
+        df_carregado = load_csv_github(url_raw)
+        if df_carregado is not None: df = df_carregado
+    elif os.path.exists(file_path):
+        try: df = pd.read_csv(file_path, dtype=str)
+        except pd.errors.EmptyDataError: pass
+    for col in df_columns:
+        if col not in df.columns: df[col] = ""
+    if 'Cashback Disponível' in df.columns: df['Cashback Disponível'] = df['Cashback Disponível'].fillna('0.0')
+    if 'Gasto Acumulado' in df.columns: df['Gasto Acumulado'] = df['Gasto Acumulado'].fillna('0.0')
+    if 'Nivel Atual' in df.columns: df['Nivel Atual'] = df['Nivel Atual'].fillna('Prata')
+    if 'Primeira Compra Feita' in df.columns: df['Primeira Compra Feita'] = df['Primeira Compra Feita'].fillna('False')
+    if 'Venda Turbo' in df.columns: df['Venda Turbo'] = df['Venda Turbo'].fillna('Não')
+    return df[df_columns]
+
+# --- Livro de lançamentos particionado por mês ---
+
+def ler_csv_armazenamento(file_path: str) -> pd.DataFrame | None:
+    """Lê um CSV do livro de lançamentos (GitHub ou local) sem mascarar falhas.
+
+    Retorna None apenas se o arquivo não existe; erros de rede ou leitura são propagados,
+    para que uma falha nunca seja confundida com um arquivo ausente.
+    """
+    if PERSISTENCE_MODE == "GITHUB":
+        response = requests.get(f"{URL_BASE_REPOS}{file_path}", timeout=10)
+        if response.status_code == 404: return None
+        response.raise_for_status()
+        conteudo = StringIO(response.text)
+    elif os.path.exists(file_path):
+        conteudo = file_path
+    else:
+        return None
+    try: return pd.read_csv(conteudo, dtype=str)
+    except pd.errors.EmptyDataError: return pd.DataFrame()
+
+def mes_particao(datas: pd.Series) -> pd.Series:
+    return pd.to_datetime(datas, errors='coerce').dt.strftime('%Y-%m').fillna('sem-data')
+
+def caminho_particao(mes: str) -> str:
+    return f"{LANÇAMENTOS_DIR}/{mes}.csv"
+
+def linhas_dos_meses(df: pd.DataFrame, meses) -> pd.Series:
+    """Máscara das linhas de `df` nas partições `meses`, comparando datas sem converter a coluna inteira."""
+    mascara = pd.Series(False, index=df.index)
+    for mes in meses:
+        if mes == 'sem-data':
+            mascara |= df['Data'].isna()
+        else:
+            inicio = pd.Timestamp(f"{mes}-01")
+            mascara |= (df['Data'] >= inicio.date()) & (df['Data'] < (inicio + pd.DateOffset(months=1)).date())
+    return mascara
+
+def marcar_meses_alterados(datas):
+    """Registra as partições modificadas na sessão; só elas são regravadas no próximo salvamento."""
+    st.session_state.meses_alterados.update(mes_particao(pd.Series(list(datas), dtype=object)).unique())
+
+def resumir_lancamentos(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty: return pd.DataFrame(columns=RESUMO_COLS).astype({'Créditos': float, 'Débitos': float, 'Vendas': int})
+    valores = pd.to_numeric(df['Valor Cashback'], errors='coerce').fillna(0.0).astype(float)
+    resumo = pd.DataFrame({
+        'Mês': mes_particao(df['Data']), 'Cliente': df['Cliente'],
+        'Créditos': valores.clip(lower=0.0), 'Débitos': -valores.clip(upper=0.0), 'Vendas': (df['Tipo'] == 'Venda').astype(int),
+    }).groupby(['Mês', 'Cliente'], as_index=False).sum()
+    resumo[['Créditos', 'Débitos']] = resumo[['Créditos', 'Débitos']].round(2)
+    return resumo[RESUMO_COLS]
+
+def resumo_lancamentos_atual() -> pd.DataFrame:
+    """Resumo por mês e cliente de todo o livro: o resumo gravado, com os meses alterados na sessão recalculados."""
+    resumo_base = st.session_state.resumo_lancamentos
+    alterados = st.session_state.meses_alterados
+    if not alterados: return resumo_base
+    df_lancamentos = st.session_state.lancamentos
+    resumo_alterados = resumir_lancamentos(df_lancamentos[linhas_dos_meses(df_lancamentos, alterados)])
+    # Partes vazias ficam fora do concat para não rebaixar as colunas numéricas a object
+    partes = [df for df in (resumo_base[~resumo_base['Mês'].isin(alterados)], resumo_alterados) if not df.empty]
+    resumo = pd.concat(partes, ignore_index=True) if partes else resumir_lancamentos(pd.DataFrame())
+    return resumo.sort_values(by=['Mês', 'Cliente']).reset_index(drop=True)
+
+@st.cache_data(show_spinner="Carregando lançamentos...")
+def carregar_lancamentos(caminhos: tuple, obrigatorio: bool = True) -> pd.DataFrame:
+    """Lê e concatena arquivos do livro. Com `obrigatorio`, um arquivo ausente é erro: as partições
+    vêm do resumo, e tratá-las como vazias faria a próxima gravação sobrescrever o mês real."""
+    partes = []
+    for caminho in caminhos:
+        df = ler_csv_armazenamento(caminho)
+        if df is None and obrigatorio: raise FileNotFoundError(f"Partição '{caminho}' consta no resumo, mas não foi encontrada.")
+        if df is not None: partes.append(df)
+    df_lancamentos = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=LANÇAMENTOS_COLS)
+    for col in LANÇAMENTOS_COLS:
+        if col not in df_lancamentos.columns: df_lancamentos[col] = ""
+    df_lancamentos = df_lancamentos[LANÇAMENTOS_COLS]
+    if not df_lancamentos.empty:
+        df_lancamentos['Data'] = pd.to_datetime(df_lancamentos['Data'], errors='coerce').dt.date
+        df_lancamentos['Venda Turbo'] = df_lancamentos['Venda Turbo'].fillna('Não').astype(str).replace({'True': 'Sim', 'False': 'Não', '': 'Não'}).fillna('Não')
+    return df_lancamentos
+
+def iniciar_lancamentos(resumo: pd.DataFrame | None):
+    """Carrega na sessão apenas as partições dos meses recentes.
+
+    `resumo` None significa que o arquivo de resumo não existe, ou seja, o livro ainda está
+    no formato antigo (arquivo único): ele é carregado por inteiro e a próxima gravação cria
+    as partições e o resumo e retira o arquivo antigo.
+    """
+    st.session_state.migrar_lancamentos_legado = resumo is None
+    if resumo is None:
+        st.session_state.resumo_lancamentos = resumir_lancamentos(pd.DataFrame())
+        st.session_state.lancamentos = carregar_lancamentos((LANÇAMENTOS_CSV,), obrigatorio=False)
+        st.session_state.lancamentos_desde = ''
+        st.session_state.meses_alterados = set(mes_particao(st.session_state.lancamentos['Data']).unique())
+    else:
+        st.session_state.resumo_lancamentos = resumo
+        desde = (pd.Timestamp(date.today()) - pd.DateOffset(months=MESES_RECENTES_LANÇAMENTOS - 1)).strftime('%Y-%m')
+        meses = sorted(m for m in resumo['Mês'].unique() if m >= desde)
+        st.session_state.lancamentos = carregar_lancamentos(tuple(caminho_particao(m) for m in meses))
+        st.session_state.lancamentos_desde = desde
+        st.session_state.meses_alterados = set()
+
+def arquivar_lancamentos_legado():
+    """Retira o arquivo único antigo após a migração, para que ele nunca volte a ser lido."""
+    if PERSISTENCE_MODE == "GITHUB":
+        try:
+            g = Github(TOKEN)
+            repo = g.get_repo(f"{REPO_OWNER}/{REPO_NAME}")
+            contents = repo.get_contents(LANÇAMENTOS_CSV, ref=BRANCH)
+            repo.delete_file(contents.path, "MIGRAÇÃO: Lançamentos particionados por mês", contents.sha, branch=BRANCH)
+        except Exception as e:
+            print(f"Aviso: '{LANÇAMENTOS_CSV}' não foi removido do GitHub: {repr(e)}")
+    elif os.path.exists(LANÇAMENTOS_CSV):
+        os.replace(LANÇAMENTOS_CSV, f"{LANÇAMENTOS_CSV}.migrado")
+
+def garantir_lancamentos_desde(mes_inicial: str) -> bool:
+    """Carrega sob demanda as partições de `mes_inicial` (AAAA-MM, '' = todo o histórico) até a janela já carregada.
+
+    Retorna False, com o erro já exibido, se alguma partição não pôde ser lida; a sessão fica inalterada.
+    """
+    desde = st.session_state.lancamentos_desde
+    if not desde or mes_inicial >= desde: return True
+    meses = sorted(m for m in st.session_state.resumo_lancamentos['Mês'].unique() if mes_inicial <= m < desde)
+    if meses:
+        try:
+            df_antigos = carregar_lancamentos(tuple(caminho_particao(m) for m in meses))
+        except Exception as e:
+            st.error("❌ ERRO ao carregar lançamentos antigos. Tente novamente.")
+            st.error(f"Detalhes: {e}")
+            print(f"--- ERRO DETALHADO CARREGAMENTO [{mes_inicial or 'histórico'}] ---\n{repr(e)}\n-----------------------------------------")
+            return False
+        st.session_state.lancamentos = pd.concat([df_antigos, st.session_state.lancamentos], ignore_index=True)
+    st.session_state.lancamentos_desde = mes_inicial
+    return True
+
+def carregar_lotes_em_aberto(cliente: str | None = None) -> pd.Series | None:
+    """Garante na sessão as partições com créditos ainda não consumidos (só os de `cliente`, se informado).
+
+    Retorna, por cliente, o total de débitos que recai sobre os lotes carregados: os créditos
+    das partições anteriores à janela já foram consumidos por completo (FIFO). Retorna None se
+    alguma partição não pôde ser carregada.
+    """
+    resumo = resumo_lancamentos_atual()
+    if cliente is not None: resumo = resumo[resumo['Cliente'] == cliente]
+    creditos_acumulados = resumo.groupby('Cliente')['Créditos'].cumsum()
+    debitos_totais = resumo['Cliente'].map(resumo.groupby('Cliente')['Débitos'].sum())
+    meses_em_aberto = resumo.loc[creditos_acumulados > debitos_totais + 0.005, 'Mês']
+    if not meses_em_aberto.empty and not garantir_lancamentos_desde(meses_em_aberto.min()): return None
+    desde = st.session_state.lancamentos_desde
+    resumo_fora_janela = resumo[resumo['Mês'] < desde] if desde else resumo.iloc[0:0]
+    debitos = resumo.groupby('Cliente')['Débitos'].sum()
+    return debitos.sub(resumo_fora_janela.groupby('Cliente')['Créditos'].sum(), fill_value=0.0).clip(lower=0.0)
+
+def carregar_particoes_retroativas() -> bool:
+    """Lançamento com data anterior à janela: carrega a partição do mês antes de regravá-la."""
+    desde = st.session_state.lancamentos_desde
+    meses_retroativos = [m for m in st.session_state.meses_alterados if m < desde] if desde else []
+    return garantir_lancamentos_desde(min(meses_retroativos)) if meses_retroativos else True
+
+def salvar_lancamentos():
+    """Regrava apenas as partições dos meses alterados na sessão e o resumo por cliente."""
+    alterados = st.session_state.meses_alterados
+    if not alterados and not st.session_state.migrar_lancamentos_legado: return
+    df_alterados = st.session_state.lancamentos[linhas_dos_meses(st.session_state.lancamentos, alterados)]
+    meses = mes_particao(df_alterados['Data'])
+    falha_particao = False
+    for mes in sorted(alterados):
+        df_mes = df_alterados[meses == mes]
+        if PERSISTENCE_MODE == "GITHUB":
+            if not salvar_dados_no_github(df_mes, caminho_particao(mes), f"AUTOSAVE: Lançamentos {mes}"):
+                falha_particao = True; continue
+        else:
+            os.makedirs(LANÇAMENTOS_DIR, exist_ok=True)
+            df_mes.to_csv(caminho_particao(mes), index=False)
+
+    # O resumo precisa descrever exatamente o que está gravado: se alguma partição falhou, ele fica
+    # como está e os meses seguem marcados, sendo regravados (com o resumo) no próximo salvamento.
+    if falha_particao: return
+    resumo = resumo_lancamentos_atual()
+    if PERSISTENCE_MODE == "GITHUB":
+        if not salvar_dados_no_github(resumo, RESUMO_LANÇAMENTOS_CSV, "AUTOSAVE: Resumo de Lançamentos"): return
+    else:
+        resumo.to_csv(RESUMO_LANÇAMENTOS_CSV, index=False)
+    st.session_state.resumo_lancamentos = resumo
+    alterados.clear()
+    if st.session_state.migrar_lancamentos_legado:
+        arquivar_lancamentos_legado()
+        st.session_state.migrar_lancamentos_legado = False
+
 def salvar_dados():
+    # Lê as partições retroativas antes de gravar qualquer arquivo, para que uma falha de leitura
+    # não deixe clientes.csv gravado com o livro de lançamentos para trás
+    if not carregar_particoes_retroativas():
+        st.error("Nenhum arquivo foi gravado; as alterações continuam na sessão e serão gravadas no próximo salvamento.")
+        return
     if PERSISTENCE_MODE == "GITHUB":
         salvar_dados_no_github(st.session_state.clientes, CLIENTES_CSV, "AUTOSAVE: Clientes")
-        salvar_dados_no_github(st.session_state.lancamentos, LANÇAMENTOS_CSV, "AUTOSAVE: Lançamentos")
         salvar_dados_no_github(st.session_state.produtos_turbo, PRODUTOS_TURBO_CSV, "AUTOSAVE: Produtos Turbo")
     else:
         st.session_state.clientes.to_csv(CLIENTES_CSV, index=False)
-        st.session_state.lancamentos.to_csv(LANÇAMENTOS_CSV, index=False)
         st.session_state.produtos_turbo.to_csv(PRODUTOS_TURBO_CSV, index=False)
+    salvar_lancamentos()
     st.cache_data.clear()
 
 @st.cache_data(show_spinner="Carregando dados dos arquivos...")
 def carregar_dados():
-    def carregar_dados_do_csv(file_path, df_columns):
-        df = pd.DataFrame(columns=df_columns)
-        if PERSISTENCE_MODE == "GITHUB":
-            url_raw = f"{URL_BASE_REPOS}{file_path}"
-            df_carregado = load_csv_github(url_raw)
-            if df_carregado is not None: df = df_carregado
-        elif os.path.exists(file_path):
-            try: df = pd.read_csv(file_path, dtype=str)
-            except pd.errors.EmptyDataError: pass
-        for col in df_columns:
-            if col not in df.columns: df[col] = ""
-        if 'Cashback Disponível' in df.columns: df['Cashback Disponível'] = df['Cashback Disponível'].fillna('0.0')
-        if 'Gasto Acumulado' in df.columns: df['Gasto Acumulado'] = df['Gasto Acumulado'].fillna('0.0')
-        if 'Nivel Atual' in df.columns: df['Nivel Atual'] = df['Nivel Atual'].fillna('Prata')
-        if 'Primeira Compra Feita' in df.columns: df['Primeira Compra Feita'] = df['Primeira Compra Feita'].fillna('False')
-        if 'Venda Turbo' in df.columns: df['Venda Turbo'] = df['Venda Turbo'].fillna('Não')
-        return df[df_columns]
-
-    CLIENTES_COLS = ['Nome', 'Apelido/Descrição', 'Telefone', 'Cashback Disponível', 'Gasto Acumulado', 'Nivel Atual', 'Indicado Por', 'Primeira Compra Feita']
     df_clientes = carregar_dados_do_csv(CLIENTES_CSV, CLIENTES_COLS)
     df_clientes['Cashback Disponível'] = pd.to_numeric(df_clientes['Cashback Disponível'], errors='coerce').fillna(0.0)
     df_clientes['Gasto Acumulado'] = pd.to_numeric(df_clientes['Gasto Acumulado'], errors='coerce').fillna(0.0)
     df_clientes['Primeira Compra Feita'] = df_clientes['Primeira Compra Feita'].astype(str).str.lower().map({'true': True, 'false': False}).fillna(False).astype(bool)
     df_clientes['Nivel Atual'] = df_clientes['Nivel Atual'].fillna('Prata')
 
-    LANÇAMENTOS_COLS = ['Data', 'Cliente', 'Tipo', 'Valor Venda/Resgate', 'Valor Cashback', 'Venda Turbo']
-    df_lancamentos = carregar_dados_do_csv(LANÇAMENTOS_CSV, LANÇAMENTOS_COLS)
-    if not df_lancamentos.empty:
-        df_lancamentos['Data'] = pd.to_datetime(df_lancamentos['Data'], errors='coerce').dt.date
-        df_lancamentos['Venda Turbo'] = df_lancamentos['Venda Turbo'].astype(str).replace({'True': 'Sim', 'False': 'Não', '': 'Não'}).fillna('Não')
+    # None = livro ainda no formato antigo; uma falha de leitura é propagada (ver ler_csv_armazenamento)
+    df_resumo = ler_csv_armazenamento(RESUMO_LANÇAMENTOS_CSV)
+    if df_resumo is not None:
+        for col in RESUMO_COLS:
+            if col not in df_resumo.columns: df_resumo[col] = ""
+        df_resumo = df_resumo.loc[df_resumo['Mês'].fillna('').astype(str).str.len() > 0, RESUMO_COLS].reset_index(drop=True)
+        df_resumo['Créditos'] = pd.to_numeric(df_resumo['Créditos'], errors='coerce').fillna(0.0).astype(float)
+        df_resumo['Débitos'] = pd.to_numeric(df_resumo['Débitos'], errors='coerce').fillna(0.0).astype(float)
+        df_resumo['Vendas'] = pd.to_numeric(df_resumo['Vendas'], errors='coerce').fillna(0).astype(int)
+        df_resumo = df_resumo.sort_values(by=['Mês', 'Cliente']).reset_index(drop=True)
 
-    PRODUTOS_TURBO_COLS = ['Nome Produto', 'Data Início', 'Data Fim', 'Ativo']
     df_produtos_turbo = carregar_dados_do_csv(PRODUTOS_TURBO_CSV, PRODUTOS_TURBO_COLS)
     if not df_produtos_turbo.empty:
         df_produtos_turbo['Data Início'] = pd.to_datetime(df_produtos_turbo['Data Início'], errors='coerce')
         df_produtos_turbo['Data Fim'] = pd.to_datetime(df_produtos_turbo['Data Fim'], errors='coerce')
         df_produtos_turbo['Ativo'] = df_produtos_turbo['Ativo'].astype(str).str.lower().map({'true': True, 'false': False}).fillna(False).astype(bool)
 
-    return df_clientes, df_lancamentos, df_produtos_turbo
+    return df_clientes, df_produtos_turbo, df_resumo
 
 # --- Funções de Lógica de Negócio ---
 
@@ -215,18 +421,23 @@ def editar_cliente(nome_original, nome_novo, apelido, telefone):
     if idx.empty: st.error(f"Erro: Cliente '{nome_original}' não encontrado."); return
     if nome_novo != nome_original and nome_novo in st.session_state.clientes['Nome'].values:
         st.error(f"Erro: O novo nome '{nome_novo}' já está em uso."); return
+    if nome_novo != nome_original and not garantir_lancamentos_desde(''): return
     st.session_state.clientes.loc[idx, 'Nome'] = nome_novo
     st.session_state.clientes.loc[idx, 'Apelido/Descrição'] = apelido
     st.session_state.clientes.loc[idx, 'Telefone'] = telefone
     if nome_novo != nome_original:
-        st.session_state.lancamentos.loc[st.session_state.lancamentos['Cliente'] == nome_original, 'Cliente'] = nome_novo
+        linhas_cliente = st.session_state.lancamentos['Cliente'] == nome_original
+        marcar_meses_alterados(st.session_state.lancamentos.loc[linhas_cliente, 'Data'])
+        st.session_state.lancamentos.loc[linhas_cliente, 'Cliente'] = nome_novo
     salvar_dados()
     st.session_state.editing_client = False
     st.success(f"Cadastro de '{nome_novo}' atualizado!")
     st.rerun()
 
 def excluir_cliente(nome_cliente):
+    if not garantir_lancamentos_desde(''): return
     st.session_state.clientes = st.session_state.clientes[st.session_state.clientes['Nome'] != nome_cliente].reset_index(drop=True)
+    marcar_meses_alterados(st.session_state.lancamentos.loc[st.session_state.lancamentos['Cliente'] == nome_cliente, 'Data'])
     st.session_state.lancamentos = st.session_state.lancamentos[st.session_state.lancamentos['Cliente'] != nome_cliente].reset_index(drop=True)
     salvar_dados()
     st.session_state.deleting_client = False
@@ -294,6 +505,7 @@ def lancar_venda(cliente_nome, valor_venda, valor_cashback, data_venda, venda_tu
     # 5. Cria o registro da venda
     novo_lancamento = pd.DataFrame([{'Data': data_venda, 'Cliente': cliente_nome, 'Tipo': 'Venda', 'Valor Venda/Resgate': valor_venda, 'Valor Cashback': valor_cashback, 'Venda Turbo': 'Sim' if venda_turbo_selecionada else 'Não'}])
     st.session_state.lancamentos = pd.concat([st.session_state.lancamentos, novo_lancamento], ignore_index=True)
+    marcar_meses_alterados([data_venda])
 
     # 6. LÓGICA DE MENSAGEM PARA O CLIENTE QUE COMPROU
     if TELEGRAM_ENABLED:
@@ -325,6 +537,7 @@ def lancar_venda(cliente_nome, valor_venda, valor_cashback, data_venda, venda_tu
             f"🟩 *REGRAS PARA RESGATAR SEUS CRÉDITOS*\n"
             f"- Resgate máximo: *50% sobre o valor da compra.*\n"
             f"- Saldo mínimo para resgate: *R$ 20,00*.\n"
+            f"- Créditos válidos por *{DIAS_EXPIRACAO_CASHBACK} dias* a partir da data da compra.\n"
             f" \n"
             f"💬 *Fale conosco para consultar seu saldo e resgatar!*\n\n"
             f"⚠️ Adicione este número na sua agenda para ficar por dentro das novidades."
@@ -342,10 +555,25 @@ def resgatar_cashback(cliente_nome, valor_resgate, valor_venda_atual, data_resga
     max_resgate = valor_venda_atual * 0.50
     if valor_resgate < 20: st.error("Erro: O resgate mínimo é de R$ 20,00."); return
     if valor_resgate > max_resgate: st.error(f"Erro: O resgate máximo é 50% da venda atual (R$ {max_resgate:.2f})."); return
-    if valor_resgate > saldo_disponivel: st.error(f"Erro: Saldo insuficiente (Disponível: R$ {saldo_disponivel:.2f})."); return
+
+    # Baixa os lotes vencidos antes do resgate, para que ele consuma apenas créditos ainda válidos (FIFO)
+    debitos = carregar_lotes_em_aberto(cliente_nome)
+    if debitos is None: return
+    lancamentos_cliente = st.session_state.lancamentos[st.session_state.lancamentos['Cliente'] == cliente_nome]
+    data_expiracao = min(data_resgate, date.today())
+    expiracoes = calcular_expiracoes(lancamentos_cliente, data_expiracao, debitos_por_cliente=debitos)
+    if not expiracoes.empty:
+        registrar_expiracoes(expiracoes, data_expiracao)
+        saldo_disponivel = st.session_state.clientes.loc[st.session_state.clientes['Nome'] == cliente_nome, 'Cashback Disponível'].iloc[0]
+        st.warning(f"R$ {expiracoes['Valor a Expirar'].sum():.2f} de cashback expirado foi baixado do saldo de {cliente_nome}.")
+
+    if valor_resgate > saldo_disponivel:
+        if not expiracoes.empty: salvar_dados()
+        st.error(f"Erro: Saldo insuficiente (Disponível: R$ {saldo_disponivel:.2f})."); return
     st.session_state.clientes.loc[st.session_state.clientes['Nome'] == cliente_nome, 'Cashback Disponível'] -= valor_resgate
     novo_lancamento = pd.DataFrame([{'Data': data_resgate, 'Cliente': cliente_nome, 'Tipo': 'Resgate', 'Valor Venda/Resgate': valor_venda_atual, 'Valor Cashback': -valor_resgate, 'Venda Turbo': 'Não'}])
     st.session_state.lancamentos = pd.concat([st.session_state.lancamentos, novo_lancamento], ignore_index=True)
+    marcar_meses_alterados([data_resgate])
     salvar_dados()
     st.success(f"Resgate de R$ {valor_resgate:.2f} realizado para {cliente_nome}.")
     st.rerun()
@@ -380,8 +608,10 @@ def excluir_lancamento_venda(lancamento_index: int):
         st.session_state.clientes.loc[idx_cliente, 'Nivel Atual'] = novo_nivel
 
         # Checar se a venda era a primeira e única de um cliente indicado
-        vendas_cliente = st.session_state.lancamentos[(st.session_state.lancamentos['Cliente'] == cliente_nome) & (st.session_state.lancamentos['Tipo'] == 'Venda')]
-        if len(vendas_cliente) == 1 and cliente_data_antes['Indicado Por']:
+        # Usa o resumo por cliente, pois vendas antigas podem não estar carregadas na sessão
+        resumo = resumo_lancamentos_atual()
+        total_vendas_cliente = resumo.loc[resumo['Cliente'] == cliente_nome, 'Vendas'].sum()
+        if total_vendas_cliente == 1 and cliente_data_antes['Indicado Por']:
             indicador_nome = cliente_data_antes['Indicado Por']
             st.session_state.clientes.loc[idx_cliente, 'Primeira Compra Feita'] = False
             
@@ -398,15 +628,95 @@ def excluir_lancamento_venda(lancamento_index: int):
                     (pd.to_numeric(st.session_state.lancamentos['Valor Venda/Resgate'], errors='coerce') == valor_venda)
                 ].index
                 if not idx_bonus.empty:
+                    marcar_meses_alterados(st.session_state.lancamentos.loc[idx_bonus, 'Data'])
                     st.session_state.lancamentos = st.session_state.lancamentos.drop(idx_bonus)
 
     # Excluir o lançamento da venda
+    marcar_meses_alterados([lancamento['Data']])
     st.session_state.lancamentos = st.session_state.lancamentos.drop(lancamento_index).reset_index(drop=True)
     
     st.success(f"Venda de R$ {valor_venda:.2f} para {cliente_nome} foi excluída com sucesso.")
     salvar_dados()
     st.rerun()
 
+def calcular_lotes_fifo(df_lancamentos: pd.DataFrame, data_referencia: date, dias_expiracao: int = DIAS_EXPIRACAO_CASHBACK, debitos_por_cliente: pd.Series | None = None) -> pd.DataFrame:
+    """Calcula o saldo restante de cada lote de crédito (Venda, Bônus Indicação).
+
+    Os débitos de cada cliente (Resgate, Expiração) consomem os lotes mais antigos primeiro.
+    O cálculo é vetorizado por cliente: o consumo de cada lote é o total debitado menos os
+    créditos anteriores a ele, limitado ao valor do próprio lote. `debitos_por_cliente` substitui
+    os débitos somados do próprio df quando só parte do histórico está carregada.
+    """
+    colunas = ['Cliente', 'Data', 'Vencimento', 'Valor Lote', 'Consumido', 'Restante', 'Expirado']
+    if df_lancamentos.empty: return pd.DataFrame(columns=colunas)
+    valores = pd.to_numeric(df_lancamentos['Valor Cashback'], errors='coerce').fillna(0.0)
+    if debitos_por_cliente is None:
+        debitos_por_cliente = (-valores.clip(upper=0.0)).groupby(df_lancamentos['Cliente']).sum()
+
+    lotes = pd.DataFrame({
+        'Cliente': df_lancamentos['Cliente'],
+        'Data': pd.to_datetime(df_lancamentos['Data'], errors='coerce'),
+        'Valor Lote': valores,
+    })[valores > 0]
+    if lotes.empty: return pd.DataFrame(columns=colunas)
+    lotes = lotes.sort_values(by=['Cliente', 'Data'], na_position='last')
+
+    creditos_anteriores = lotes.groupby('Cliente')['Valor Lote'].cumsum() - lotes['Valor Lote']
+    debitos_cliente = lotes['Cliente'].map(debitos_por_cliente).fillna(0.0)
+    lotes['Vencimento'] = lotes['Data'] + pd.Timedelta(days=dias_expiracao)
+    lotes['Consumido'] = (debitos_cliente - creditos_anteriores).clip(lower=0.0, upper=lotes['Valor Lote'])
+    lotes['Restante'] = (lotes['Valor Lote'] - lotes['Consumido']).round(2)
+    lotes['Expirado'] = (lotes['Vencimento'] <= pd.Timestamp(data_referencia)) & (lotes['Restante'] > 0)
+    return lotes[colunas]
+
+def calcular_expiracoes(df_lancamentos: pd.DataFrame, data_referencia: date, dias_expiracao: int = DIAS_EXPIRACAO_CASHBACK, debitos_por_cliente: pd.Series | None = None) -> pd.DataFrame:
+    """Prévia por cliente do cashback que expira na data de referência (nada é gravado)."""
+    lotes = calcular_lotes_fifo(df_lancamentos, data_referencia, dias_expiracao, debitos_por_cliente)
+    vencidos = lotes[lotes['Expirado']]
+    if vencidos.empty: return pd.DataFrame(columns=['Cliente', 'Lotes', 'Crédito Mais Antigo', 'Valor a Expirar'])
+    expiracoes = vencidos.groupby('Cliente').agg(**{
+        'Lotes': ('Restante', 'size'),
+        'Crédito Mais Antigo': ('Data', 'min'),
+        'Valor a Expirar': ('Restante', 'sum'),
+    }).reset_index()
+    expiracoes['Crédito Mais Antigo'] = expiracoes['Crédito Mais Antigo'].dt.date
+    expiracoes['Valor a Expirar'] = expiracoes['Valor a Expirar'].round(2)
+    return expiracoes.sort_values(by='Valor a Expirar', ascending=False).reset_index(drop=True)
+
+def registrar_expiracoes(df_expiracoes: pd.DataFrame, data_referencia: date):
+    """Lança um registro 'Expiração' por cliente e baixa o valor do 'Cashback Disponível' (sem salvar).
+
+    O lançamento encerra os lotes vencidos pelo valor integral. Já a baixa no saldo é limitada
+    ao saldo atual, para nunca deixá-lo negativo; a diferença (saldo já divergente do histórico)
+    é informada em vez de reaplicada nas próximas expirações.
+    """
+    valor_por_cliente = df_expiracoes.set_index('Cliente')['Valor a Expirar']
+    saldos = st.session_state.clientes['Cashback Disponível']
+    baixa = st.session_state.clientes['Nome'].map(valor_por_cliente).fillna(0.0).clip(upper=saldos.clip(lower=0.0))
+    st.session_state.clientes['Cashback Disponível'] = saldos - baixa
+    divergencia = valor_por_cliente.sum() - baixa.sum()
+    if divergencia > 0.005:
+        st.warning(f"Atenção: R$ {divergencia:.2f} em créditos vencidos já não constavam do saldo das clientes (saldo divergente do histórico). Os lotes foram encerrados sem baixa adicional.")
+    novos_lancamentos = pd.DataFrame({
+        'Data': data_referencia, 'Cliente': df_expiracoes['Cliente'], 'Tipo': 'Expiração',
+        'Valor Venda/Resgate': 0.0, 'Valor Cashback': -df_expiracoes['Valor a Expirar'], 'Venda Turbo': 'Não'
+    })
+    st.session_state.lancamentos = pd.concat([st.session_state.lancamentos, novos_lancamentos], ignore_index=True)
+    marcar_meses_alterados([data_referencia])
+
+def processar_expiracao_cashback(data_referencia: date):
+    if data_referencia > date.today():
+        st.error("Erro: Não é possível lançar expirações com data futura."); return
+    debitos = carregar_lotes_em_aberto()
+    if debitos is None: return
+    expiracoes = calcular_expiracoes(st.session_state.lancamentos, data_referencia, debitos_por_cliente=debitos)
+    if expiracoes.empty:
+        st.info("Nenhum crédito a expirar nesta data."); return
+    registrar_expiracoes(expiracoes, data_referencia)
+    salvar_dados()
+    st.success(f"Expiração de R$ {expiracoes['Valor a Expirar'].sum():.2f} lançada para {len(expiracoes)} cliente(s).")
+    st.rerun()
+
 # ==============================================================================
 # ESTRUTURA E LAYOUT DO STREAMLIT
 # ==============================================================================
@@ -577,16 +887,41 @@ def render_relatorios():
     st.dataframe(ranking_cashback[['Nome', 'Cashback Disponível']].head(10), hide_index=True, use_container_width=True)
     st.markdown("---")
     st.subheader("📄 Histórico de Lançamentos")
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     data_selecionada = col1.date_input("Filtrar por Data:", value=None)
-    tipo_selecionado = col2.selectbox("Filtrar por Tipo:", ['Todos', 'Venda', 'Resgate', 'Bônus Indicação'])
+    tipo_selecionado = col2.selectbox("Filtrar por Tipo:", ['Todos', 'Venda', 'Resgate', 'Bônus Indicação', 'Expiração'])
+    historico_completo = col3.checkbox("Incluir histórico completo", value=False)
+    # Partições antigas só são carregadas quando o filtro pede por elas
+    if historico_completo: garantir_lancamentos_desde('')
+    elif data_selecionada: garantir_lancamentos_desde(data_selecionada.strftime('%Y-%m'))
+    if st.session_state.lancamentos_desde:
+        st.caption(f"Exibindo lançamentos a partir de {st.session_state.lancamentos_desde}.")
     df_historico = st.session_state.lancamentos.copy()
-    if data_selecionada: df_historico = df_historico[df_historico['Data'].dt.date == data_selecionada]
+    if data_selecionada: df_historico = df_historico[pd.to_datetime(df_historico['Data'], errors='coerce').dt.date == data_selecionada]
     if tipo_selecionado != 'Todos': df_historico = df_historico[df_historico['Tipo'] == tipo_selecionado]
     if not df_historico.empty:
         st.dataframe(df_historico.sort_values(by="Data", ascending=False), hide_index=True, use_container_width=True)
     else: st.info("Nenhum lançamento encontrado com os filtros selecionados.")
     
+    st.markdown("---")
+    st.subheader("⏳ Expiração de Cashback")
+    st.caption(f"Créditos não resgatados expiram {DIAS_EXPIRACAO_CASHBACK} dias após a data do lançamento. Os resgates consomem os créditos mais antigos primeiro.")
+    # A prévia precisa das partições com créditos em aberto; só as carrega quando pedida
+    if st.checkbox("Calcular prévia de expiração (carrega meses antigos com saldo em aberto)", key='mostrar_expiracao'):
+        data_expiracao = st.date_input("Data de Referência da Expiração:", value=date.today(), key='data_expiracao')
+        debitos = carregar_lotes_em_aberto() # Carrega as partições antes de ler o livro da sessão
+        if debitos is not None: # Em caso de falha o erro já foi exibido
+            expiracoes_previstas = calcular_expiracoes(st.session_state.lancamentos, data_expiracao, debitos_por_cliente=debitos)
+            if expiracoes_previstas.empty:
+                st.info("Nenhum crédito a expirar até a data selecionada.")
+            else:
+                st.metric("Total a Expirar", f"R$ {expiracoes_previstas['Valor a Expirar'].sum():,.2f}")
+                st.dataframe(expiracoes_previstas, hide_index=True, use_container_width=True)
+                if data_expiracao > date.today():
+                    st.caption("Data futura: apenas prévia. As expirações só podem ser lançadas até a data de hoje.")
+                elif st.button("⏳ Lançar Expirações", type="primary"):
+                    processar_expiracao_cashback(data_expiracao)
+
     st.markdown("---")
     st.subheader("🗑️ Excluir Lançamento de Venda")
     vendas_df = st.session_state.lancamentos[st.session_state.lancamentos['Tipo'] == 'Venda'].copy()
@@ -671,7 +1006,16 @@ if 'valor_venda' not in st.session_state: st.session_state.valor_venda = 0.00
 if 'data_version' not in st.session_state: st.session_state.data_version = 0
 
 if 'clientes' not in st.session_state:
-    st.session_state.clientes, st.session_state.lancamentos, st.session_state.produtos_turbo = carregar_dados()
+    try:
+        df_clientes, df_produtos_turbo, df_resumo = carregar_dados()
+        iniciar_lancamentos(df_resumo)
+    except Exception as e:
+        # Sem o livro de lançamentos não há como salvar com segurança: interrompe em vez de sobrescrever dados
+        st.error("❌ ERRO CRÍTICO ao carregar o livro de lançamentos. Recarregue a página para tentar novamente.")
+        st.error(f"Detalhes: {e}")
+        print(f"--- ERRO DETALHADO CARREGAMENTO ---\n{repr(e)}\n-----------------------------------------")
+        st.stop()
+    st.session_state.clientes, st.session_state.produtos_turbo = df_clientes, df_produtos_turbo
 
 render_header()
 st.markdown('<div style="padding-top: 20px;">', unsafe_allow_html=True)